@@ -1,12 +1,26 @@
 import os
 import json
+import random
 import re
 import logging
 import csv
 import io
 import asyncio
+import functools
+import hashlib
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+import weakref
+import zlib
+from collections import Counter, deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
 from datetime import datetime, timedelta
 from typing import Union, Optional, List, Dict, Any
+from urllib.parse import urlparse
 
 import aiohttp
 import asyncpg
@@ -18,6 +32,7 @@ from telegram.ext import (
     ContextTypes, CallbackQueryHandler
 )
 from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter
 
 # ---------- Environment & Configuration ----------
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
@@ -38,12 +53,42 @@ DATABASE_URL = os.environ.get("DATABASE_URL")
 if not DATABASE_URL:
     raise ValueError("DATABASE_URL environment variable is missing")
 
+# Runtime mode: "webhook" (FastAPI receives updates) or "polling" (getUpdates, no public ingress)
+BOT_MODE = os.environ.get("BOT_MODE", "webhook").lower()
+if BOT_MODE not in ("webhook", "polling"):
+    raise ValueError("BOT_MODE must be 'webhook' or 'polling'")
+
 WEBHOOK_URL = os.environ.get("WEBHOOK_URL") or os.environ.get("RENDER_EXTERNAL_URL")
-if not WEBHOOK_URL:
+if BOT_MODE == "webhook" and not WEBHOOK_URL:
     raise ValueError("WEBHOOK_URL or RENDER_EXTERNAL_URL must be set")
 
+# Max updates processed at once in polling mode
+UPDATE_CONCURRENCY = int(os.environ.get("UPDATE_CONCURRENCY", "16"))
+
+# Outbound sends: global Bot API budget (Telegram allows ~30 msg/s) and in-flight request cap
+OUTBOX_GLOBAL_RATE = float(os.environ.get("OUTBOX_GLOBAL_RATE", "25"))
+OUTBOX_CONCURRENCY = int(os.environ.get("OUTBOX_CONCURRENCY", "8"))
+
+# Keep-warm probes for upstreams that sleep when idle (Render free services spin down after ~15 min)
+PRIME_HOST_SUFFIXES = tuple(
+    x.strip() for x in os.environ.get("PRIME_HOST_SUFFIXES", ".onrender.com").split(",") if x.strip()
+)
+PRIME_INTERVAL = float(os.environ.get("PRIME_INTERVAL", "300"))             # seconds between cycles
+PRIME_IDLE_AFTER = float(os.environ.get("PRIME_IDLE_AFTER", "600"))         # probe hosts quiet this long
+PRIME_DEMAND_WINDOW = float(os.environ.get("PRIME_DEMAND_WINDOW", "3600"))  # ...if used this recently
+PRIME_MAX_PROBES = int(os.environ.get("PRIME_MAX_PROBES", "4"))             # probes per cycle
+
+# Tracing: updates slower than this are logged as warnings; the last TRACE_KEEP are kept for /slowtraces
+TRACE_SLOW_MS = float(os.environ.get("TRACE_SLOW_MS", "3000"))
+TRACE_KEEP = int(os.environ.get("TRACE_KEEP", "200"))
+
 PORT = int(os.environ.get("PORT", 8080))
 
+# Graceful shutdown: how long in-flight work may run before it is cancelled (Render allows 30s)
+SHUTDOWN_DRAIN_TIMEOUT = float(os.environ.get("SHUTDOWN_DRAIN_TIMEOUT", "25"))
+# Keep the webhook registered across restarts so Telegram queues updates for the next instance
+DELETE_WEBHOOK_ON_SHUTDOWN = os.environ.get("DELETE_WEBHOOK_ON_SHUTDOWN", "0") == "1"
+
 # Branding removal (global)
 BRANDING_BLACKLIST = [
     '@patelkrish_99', 'patelkrish_99', 't.me/anshapi', 'anshapi',
@@ -63,14 +108,69 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # ---------- PostgreSQL Database (async) ----------
+def encode_result(result: Any) -> (bytes, bytes):
+    """Canonical JSON of a lookup result -> (sha256 digest, zlib-compressed bytes)."""
+    raw = json.dumps(result, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()
+    return hashlib.sha256(raw).digest(), zlib.compress(raw, 9)
+
+def decode_result(blob: bytes) -> Any:
+    return json.loads(zlib.decompress(blob))
+
+
+class PreparedConnection(asyncpg.Connection):
+    """Pool connection that keeps its hot statements prepared for its whole lifetime."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.statements: Dict[str, Any] = {}
+
+
 class Database:
     _pool: asyncpg.Pool = None
 
+    # Statements on the per-command path, prepared once per connection in the pool init hook
+    STATEMENTS = {
+        "touch_user": '''
+            INSERT INTO users (user_id, username, first_name, last_name, last_activity)
+            VALUES ($1, $2, $3, $4, CURRENT_TIMESTAMP)
+            ON CONFLICT (user_id) DO UPDATE SET
+                username = EXCLUDED.username,
+                first_name = EXCLUDED.first_name,
+                last_name = EXCLUDED.last_name,
+                last_activity = CURRENT_TIMESTAMP
+            RETURNING is_admin
+        ''',
+        "get_user": "SELECT * FROM users WHERE user_id = $1",
+        "is_admin": "SELECT is_admin FROM users WHERE user_id = $1",
+        "add_lookup": '''
+            WITH stored AS (
+                INSERT INTO lookup_results (hash, data) VALUES ($4, $5)
+                ON CONFLICT (hash) DO NOTHING
+            )
+            INSERT INTO lookups (user_id, command, input, result_hash)
+            VALUES ($1, $2, $3, $4)
+        ''',
+    }
+
     @classmethod
     async def init_pool(cls):
-        """Create a connection pool to PostgreSQL."""
-        cls._pool = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=10)
-        await cls.create_tables()
+        """Create the schema, then a connection pool to PostgreSQL."""
+        # Tables must exist before any pooled connection can prepare statements against them
+        conn = await asyncpg.connect(DATABASE_URL)
+        try:
+            await cls.create_tables(conn)
+        finally:
+            await conn.close()
+        cls._pool = await asyncpg.create_pool(
+            DATABASE_URL, min_size=1, max_size=10,
+            connection_class=PreparedConnection, init=cls._prepare_connection
+        )
+
+    @classmethod
+    async def _prepare_connection(cls, conn: PreparedConnection):
+        """Pool `init` hook: prepare every hot statement on a freshly opened connection."""
+        for name, query in cls.STATEMENTS.items():
+            conn.statements[name] = await conn.prepare(query)
 
     @classmethod
     async def close_pool(cls):
@@ -79,9 +179,17 @@ class Database:
             await cls._pool.close()
 
     @classmethod
-    async def create_tables(cls):
-        """Create necessary tables if they do not exist."""
+    @asynccontextmanager
+    async def transaction(cls):
+        """Acquire a pooled connection and run everything inside one transaction."""
         async with cls._pool.acquire() as conn:
+            async with conn.transaction():
+                yield conn
+
+    @classmethod
+    async def create_tables(cls, conn: asyncpg.Connection):
+        """Create necessary tables if they do not exist."""
+        async with conn.transaction():
             # Users table
             await conn.execute('''
                 CREATE TABLE IF NOT EXISTS users (
@@ -106,34 +214,48 @@ class Database:
                     result_summary TEXT
                 )
             ''')
+            # Full lookup results, zlib-compressed and shared by content hash
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS lookup_results (
+                    hash BYTEA PRIMARY KEY,
+                    data BYTEA NOT NULL
+                )
+            ''')
+            # result_summary stays for rows written before results were stored compressed
+            await conn.execute('''
+                ALTER TABLE lookups ADD COLUMN IF NOT EXISTS
+                    result_hash BYTEA REFERENCES lookup_results(hash)
+            ''')
+            # Orphan checks on user deletion look lookups up by result
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS lookups_result_hash_idx ON lookups (result_hash)"
+            )
             # Ensure initial admins from env are stored
-            for admin_id in ADMIN_IDS:
-                await conn.execute('''
-                    INSERT INTO users (user_id, is_admin)
-                    VALUES ($1, 1)
-                    ON CONFLICT (user_id) DO UPDATE SET is_admin = 1
-                ''', admin_id)
-            logger.info("Database tables initialized")
+            await conn.executemany('''
+                INSERT INTO users (user_id, is_admin)
+                VALUES ($1, 1)
+                ON CONFLICT (user_id) DO UPDATE SET is_admin = 1
+            ''', [(admin_id,) for admin_id in ADMIN_IDS])
+        logger.info("Database tables initialized")
 
     @classmethod
     async def get_user(cls, user_id: int) -> Optional[Dict[str, Any]]:
         async with cls._pool.acquire() as conn:
-            row = await conn.fetchrow("SELECT * FROM users WHERE user_id = $1", user_id)
+            row = await conn.statements["get_user"].fetchrow(user_id)
             return dict(row) if row else None
 
+    @classmethod
+    async def touch_user(cls, user_id: int, username: str = None,
+                         first_name: str = None, last_name: str = None) -> Dict[str, int]:
+        """Upsert the user and return their is_admin flag in one round-trip."""
+        async with cls._pool.acquire() as conn:
+            row = await conn.statements["touch_user"].fetchrow(user_id, username, first_name, last_name)
+            return dict(row)
+
     @classmethod
     async def add_or_update_user(cls, user_id: int, username: str = None,
                                  first_name: str = None, last_name: str = None):
-        async with cls._pool.acquire() as conn:
-            await conn.execute('''
-                INSERT INTO users (user_id, username, first_name, last_name, last_activity)
-                VALUES ($1, $2, $3, $4, CURRENT_TIMESTAMP)
-                ON CONFLICT (user_id) DO UPDATE SET
-                    username = EXCLUDED.username,
-                    first_name = EXCLUDED.first_name,
-                    last_name = EXCLUDED.last_name,
-                    last_activity = CURRENT_TIMESTAMP
-            ''', user_id, username, first_name, last_name)
+        await cls.touch_user(user_id, username, first_name, last_name)
 
     @classmethod
     async def update_activity(cls, user_id: int):
@@ -144,12 +266,26 @@ class Database:
             )
 
     @classmethod
-    async def add_lookup(cls, user_id: int, command: str, input_str: str, result_summary: str = ""):
+    async def add_lookup(cls, user_id: int, command: str, input_str: str, result: Any = None):
+        """Record a lookup; identical results are stored once in lookup_results."""
+        digest, blob = encode_result(result)
         async with cls._pool.acquire() as conn:
-            await conn.execute('''
-                INSERT INTO lookups (user_id, command, input, result_summary)
-                VALUES ($1, $2, $3, $4)
-            ''', user_id, command, input_str, result_summary[:500])
+            await conn.statements["add_lookup"].fetchval(user_id, command, input_str, digest, blob)
+
+    @classmethod
+    async def get_lookup_result(cls, lookup_id: int) -> Optional[Any]:
+        """Full stored result of a lookup (legacy rows return their truncated summary)."""
+        async with cls._pool.acquire() as conn:
+            row = await conn.fetchrow('''
+                SELECT r.data, l.result_summary FROM lookups l
+                LEFT JOIN lookup_results r ON r.hash = l.result_hash
+                WHERE l.id = $1
+            ''', lookup_id)
+        if not row:
+            return None
+        if row['data'] is not None:
+            return decode_result(row['data'])
+        return row['result_summary']
 
     @classmethod
     async def is_user_banned(cls, user_id: int) -> bool:
@@ -157,6 +293,12 @@ class Database:
             val = await conn.fetchval("SELECT is_banned FROM users WHERE user_id = $1", user_id)
             return bool(val) if val is not None else False
 
+    @classmethod
+    async def is_admin(cls, user_id: int) -> bool:
+        async with cls._pool.acquire() as conn:
+            val = await conn.statements["is_admin"].fetchval(user_id)
+            return val == 1
+
     @classmethod
     async def set_ban(cls, user_id: int, ban: bool):
         async with cls._pool.acquire() as conn:
@@ -186,7 +328,7 @@ class Database:
     async def get_user_lookups(cls, user_id: int, limit: int = 50) -> List[Dict[str, Any]]:
         async with cls._pool.acquire() as conn:
             rows = await conn.fetch('''
-                SELECT command, input, timestamp FROM lookups
+                SELECT id, command, input, timestamp FROM lookups
                 WHERE user_id = $1
                 ORDER BY timestamp DESC LIMIT $2
             ''', user_id, limit)
@@ -196,11 +338,14 @@ class Database:
     @classmethod
     async def get_stats(cls):
         async with cls._pool.acquire() as conn:
-            total_users = await conn.fetchval("SELECT COUNT(*) FROM users")
-            banned = await conn.fetchval("SELECT COUNT(*) FROM users WHERE is_banned = 1")
-            total_lookups = await conn.fetchval("SELECT COUNT(*) FROM lookups")
-            active_users = await conn.fetchval("SELECT COUNT(DISTINCT user_id) FROM lookups")
-            return total_users, banned, total_lookups, active_users
+            row = await conn.fetchrow('''
+                SELECT
+                    (SELECT COUNT(*) FROM users) AS total_users,
+                    (SELECT COUNT(*) FROM users WHERE is_banned = 1) AS banned,
+                    (SELECT COUNT(*) FROM lookups) AS total_lookups,
+                    (SELECT COUNT(DISTINCT user_id) FROM lookups) AS active_users
+            ''')
+            return row['total_users'], row['banned'], row['total_lookups'], row['active_users']
 
     @classmethod
     async def get_lookup_stats_per_command(cls):
@@ -213,14 +358,19 @@ class Database:
 
     @classmethod
     async def get_daily_lookups(cls, days: int):
+        today = datetime.now().date()
+        since = today - timedelta(days=days - 1)
+        async with cls._pool.acquire() as conn:
+            rows = await conn.fetch('''
+                SELECT DATE(timestamp) AS day, COUNT(*) AS cnt FROM lookups
+                WHERE timestamp >= $1
+                GROUP BY day
+            ''', datetime.combine(since, datetime.min.time()))
+        counts = {r['day']: r['cnt'] for r in rows}
         data = []
         for i in range(days):
-            day = (datetime.now() - timedelta(days=i)).strftime("%Y-%m-%d")
-            async with cls._pool.acquire() as conn:
-                cnt = await conn.fetchval('''
-                    SELECT COUNT(*) FROM lookups WHERE DATE(timestamp) = $1
-                ''', day)
-                data.append((day, cnt))
+            day = today - timedelta(days=i)
+            data.append((day.strftime("%Y-%m-%d"), counts.get(day, 0)))
         return data
 
     @classmethod
@@ -253,8 +403,63 @@ class Database:
 
     @classmethod
     async def delete_user(cls, user_id: int):
-        async with cls._pool.acquire() as conn:
-            await conn.execute("DELETE FROM users WHERE user_id = $1", user_id)
+        await cls.delete_users([user_id])
+
+    # Bulk admin operations: one set-based statement per chunk, all chunks in one transaction
+    BULK_CHUNK = 5000
+
+    @classmethod
+    async def set_ban_many(cls, user_ids: List[int], ban: bool) -> List[int]:
+        """Set the ban flag for all `user_ids`; returns the ids that existed."""
+        return await cls._bulk(
+            "UPDATE users SET is_banned = $2 WHERE user_id = ANY($1::bigint[]) RETURNING user_id",
+            user_ids, 1 if ban else 0
+        )
+
+    @classmethod
+    async def delete_users(cls, user_ids: List[int]) -> List[int]:
+        """Delete all `user_ids` (their lookups cascade) and the results only they referenced.
+
+        Returns the ids that existed.
+        """
+        deleted = []
+        async with cls.transaction() as conn:
+            for i in range(0, len(user_ids), cls.BULK_CHUNK):
+                chunk = user_ids[i:i + cls.BULK_CHUNK]
+                hashes = await conn.fetchval('''
+                    SELECT array_agg(DISTINCT result_hash) FROM lookups
+                    WHERE user_id = ANY($1::bigint[]) AND result_hash IS NOT NULL
+                ''', chunk)
+                rows = await conn.fetch(
+                    "DELETE FROM users WHERE user_id = ANY($1::bigint[]) RETURNING user_id", chunk
+                )
+                deleted.extend(r['user_id'] for r in rows)
+                if hashes:
+                    await cls._purge_results(conn, hashes)
+        return deleted
+
+    @classmethod
+    async def _purge_results(cls, conn: asyncpg.Connection, hashes: List[bytes]):
+        """Drop stored results among `hashes` that no lookup references any more."""
+        try:
+            # Savepoint: a concurrent lookup re-referencing a result must not abort the deletion
+            async with conn.transaction():
+                await conn.execute('''
+                    DELETE FROM lookup_results r
+                    WHERE r.hash = ANY($1::bytea[])
+                      AND NOT EXISTS (SELECT 1 FROM lookups l WHERE l.result_hash = r.hash)
+                ''', hashes)
+        except asyncpg.ForeignKeyViolationError as e:
+            logger.warning(f"Skipped result cleanup, results still referenced: {e}")
+
+    @classmethod
+    async def _bulk(cls, query: str, user_ids: List[int], *args) -> List[int]:
+        affected = []
+        async with cls.transaction() as conn:
+            for i in range(0, len(user_ids), cls.BULK_CHUNK):
+                rows = await conn.fetch(query, user_ids[i:i + cls.BULK_CHUNK], *args)
+                affected.extend(r['user_id'] for r in rows)
+        return affected
 
     @classmethod
     async def search_users(cls, query: str):
@@ -266,6 +471,615 @@ class Database:
             ''', f'%{query}%')
             return [dict(r) for r in rows]
 
+# ---------- Lifecycle (in-flight tracking) ----------
+class Lifecycle:
+    """Tracks in-flight work so shutdown can stop intake and drain it before closing the pool."""
+    _tasks: set = set()
+    _accepting: bool = True
+
+    @classmethod
+    def is_accepting(cls) -> bool:
+        return cls._accepting
+
+    @classmethod
+    def stop_accepting(cls):
+        cls._accepting = False
+
+    @classmethod
+    def spawn(cls, coro, name: str = None) -> asyncio.Task:
+        """Run `coro` as a tracked task; shutdown waits for it (up to the drain deadline)."""
+        task = asyncio.create_task(coro, name=name)
+        cls._tasks.add(task)
+        task.add_done_callback(cls._on_task_done)
+        return task
+
+    @classmethod
+    def _on_task_done(cls, task: asyncio.Task):
+        cls._tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error(f"Task {task.get_name()} failed: {task.exception()!r}")
+
+    @classmethod
+    async def drain(cls, timeout: float):
+        """Stop accepting updates, wait for tracked tasks, cancel whatever outlives `timeout`."""
+        cls.stop_accepting()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        # Tasks may spawn follow-up writes while draining, so keep waiting until the set is empty
+        while cls._tasks:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            logger.info(f"Draining {len(cls._tasks)} in-flight task(s)")
+            await asyncio.wait(set(cls._tasks), timeout=remaining)
+        if cls._tasks:
+            pending = set(cls._tasks)
+            logger.warning(f"Drain deadline reached, cancelling {len(pending)} task(s)")
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+# ---------- Telemetry (in-memory ring buffers) ----------
+class MinuteRing:
+    """Per-minute counters over the last `size` minutes; slots are reused as minutes roll over."""
+
+    def __init__(self, size: int = 60):
+        self.size = size
+        self._minutes = [-1] * size
+        self._counts = [0] * size
+
+    def add(self, n: int = 1):
+        minute = int(time.time() // 60)
+        i = minute % self.size
+        if self._minutes[i] != minute:
+            self._minutes[i] = minute
+            self._counts[i] = 0
+        self._counts[i] += n
+
+    def total(self, minutes: int) -> int:
+        current = int(time.time() // 60)
+        return sum(c for m, c in zip(self._minutes, self._counts) if 0 <= current - m < minutes)
+
+
+class MinuteLatency:
+    """Latency samples (ms) per minute slot, aligned with MinuteRing, for windowed quantiles.
+
+    Each slot keeps a uniform reservoir of at most `per_minute` samples plus the true
+    count, so busy minutes are weighted correctly when slots are merged.
+    """
+
+    def __init__(self, size: int = 60, per_minute: int = 128):
+        self.size = size
+        self.per_minute = per_minute
+        self._minutes = [-1] * size
+        self._counts = [0] * size
+        self._samples: List[List[float]] = [[] for _ in range(size)]
+
+    def add(self, ms: float):
+        minute = int(time.time() // 60)
+        i = minute % self.size
+        if self._minutes[i] != minute:
+            self._minutes[i] = minute
+            self._counts[i] = 0
+            self._samples[i] = []
+        self._counts[i] += 1
+        samples = self._samples[i]
+        if len(samples) < self.per_minute:
+            samples.append(ms)
+        else:
+            j = random.randrange(self._counts[i])
+            if j < self.per_minute:
+                samples[j] = ms
+
+    def quantiles(self, minutes: int, *qs: float) -> List[Optional[float]]:
+        """Quantiles over the last `minutes` minutes only."""
+        current = int(time.time() // 60)
+        weighted = []
+        for m, count, samples in zip(self._minutes, self._counts, self._samples):
+            if 0 <= current - m < minutes and samples:
+                weight = count / len(samples)
+                weighted.extend((ms, weight) for ms in samples)
+        if not weighted:
+            return [None] * len(qs)
+        weighted.sort()
+        total = sum(w for _, w in weighted)
+        result = []
+        for q in qs:
+            target, acc = q * total, 0.0
+            value = weighted[-1][0]
+            for ms, w in weighted:
+                acc += w
+                if acc > target:
+                    value = ms
+                    break
+            result.append(value)
+        return result
+
+
+class Telemetry:
+    """Process-local counters behind /live; rendering never touches the database."""
+    _commands: Dict[str, MinuteRing] = {}
+    _upstream_ok: Dict[str, MinuteRing] = {}
+    _upstream_err: Dict[str, MinuteRing] = {}
+    _upstream_latency: Dict[str, MinuteLatency] = {}
+    _update_latency = MinuteLatency()
+    _updates = MinuteRing()
+
+    @classmethod
+    def record_command(cls, command: str):
+        """Count one lookup command (admin commands are not tracked)."""
+        cls._commands.setdefault(command, MinuteRing()).add()
+
+    @classmethod
+    def record_upstream(cls, host: str, ms: float, ok: bool):
+        ring = cls._upstream_ok if ok else cls._upstream_err
+        ring.setdefault(host, MinuteRing()).add()
+        cls._upstream_latency.setdefault(host, MinuteLatency()).add(ms)
+
+    @classmethod
+    def record_update(cls, ms: float):
+        cls._updates.add()
+        cls._update_latency.add(ms)
+
+    @classmethod
+    def render(cls, minutes: int) -> str:
+        """Compact fixed-width view of the last `minutes` minutes."""
+        def fmt(ms):
+            return "-" if ms is None else f"{ms:.0f}"
+
+        lines = [f"Live · last {minutes}m · {datetime.now():%H:%M:%S}", ""]
+        p50, p95, p99 = cls._update_latency.quantiles(minutes, 0.5, 0.95, 0.99)
+        lines.append(f"updates {cls._updates.total(minutes)}  p50 {fmt(p50)}  p95 {fmt(p95)}  p99 {fmt(p99)} ms")
+        lines.append("")
+
+        counts = sorted(((cmd, ring.total(minutes)) for cmd, ring in cls._commands.items()),
+                        key=lambda x: x[1], reverse=True)
+        lines.append(f"{'lookup':<12}{'total':>7}{'/min':>7}")
+        for cmd, cnt in counts:
+            if cnt:
+                lines.append(f"{cmd:<12}{cnt:>7}{cnt / minutes:>7.1f}")
+        lines.append("")
+
+        lines.append(f"{'upstream':<23}{'req':>5}{'err%':>6}{'p50':>6}{'p95':>6}{'p99':>6}")
+        for host in sorted(set(cls._upstream_ok) | set(cls._upstream_err)):
+            ok = cls._upstream_ok[host].total(minutes) if host in cls._upstream_ok else 0
+            err = cls._upstream_err[host].total(minutes) if host in cls._upstream_err else 0
+            if not ok + err:
+                continue
+            q = cls._upstream_latency[host].quantiles(minutes, 0.5, 0.95, 0.99)
+            lines.append(f"{host[:22]:<23}{ok + err:>5}{100 * err / (ok + err):>6.1f}"
+                         + "".join(f"{fmt(v):>6}" for v in q))
+        return "\n".join(lines)
+
+# ---------- Tracing ----------
+trace_logger = logging.getLogger("trace")
+
+class Trace:
+    """Timing record for one update: root duration plus one entry per pipeline stage."""
+
+    def __init__(self, source: str, **attrs):
+        self.source = source
+        self.attrs = attrs
+        self.spans: List[tuple] = []  # (name, offset_ms, duration_ms)
+        self.started_at = datetime.now()
+        self.started = time.perf_counter()
+        self.duration_ms = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "source": self.source,
+            "started_at": self.started_at.isoformat(timespec="milliseconds"),
+            "duration_ms": round(self.duration_ms, 1),
+            **self.attrs,
+            "spans": [
+                {"name": name, "offset_ms": round(offset, 1), "duration_ms": round(dur, 1)}
+                for name, offset, dur in self.spans
+            ],
+        }
+
+
+class Tracer:
+    """Per-update tracing carried through handlers in a context variable."""
+    _current: ContextVar = ContextVar("trace", default=None)
+    _recent: deque = deque(maxlen=TRACE_KEEP)
+
+    @classmethod
+    @contextmanager
+    def trace(cls, source: str, **attrs):
+        """Root span for one update; logged as JSON when it ends."""
+        trace = Trace(source, **attrs)
+        token = cls._current.set(trace)
+        try:
+            yield trace
+        except Exception as e:
+            trace.attrs["error"] = repr(e)
+            raise
+        finally:
+            cls._current.reset(token)
+            trace.duration_ms = (time.perf_counter() - trace.started) * 1000
+            cls._recent.append(trace)
+            Telemetry.record_update(trace.duration_ms)
+            slow = trace.duration_ms >= TRACE_SLOW_MS
+            record = json.dumps({**trace.as_dict(), "slow": slow}, default=str, ensure_ascii=False)
+            trace_logger.log(logging.WARNING if slow else logging.INFO, record)
+
+    @classmethod
+    @contextmanager
+    def span(cls, name: str):
+        """Child span of the current trace; a no-op outside of one."""
+        trace = cls._current.get()
+        if trace is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            trace.spans.append((name, (start - trace.started) * 1000, (end - start) * 1000))
+
+    @classmethod
+    def annotate(cls, **attrs):
+        trace = cls._current.get()
+        if trace is not None:
+            trace.attrs.update(attrs)
+
+    @classmethod
+    def slowest(cls, limit: int = 5) -> List[Trace]:
+        return sorted(cls._recent, key=lambda t: t.duration_ms, reverse=True)[:limit]
+
+# ---------- Profiling (admin /profile) ----------
+class Profiler:
+    """Live-process inspection: loop debug mode, CPU sampling, tracemalloc and task ages."""
+    _task_born = weakref.WeakKeyDictionary()
+    _loop_thread_id: int = None
+    _last_snapshot: tracemalloc.Snapshot = None
+    _asyncio_log_level: Optional[int] = None  # level to restore when loop debug is turned off
+
+    @classmethod
+    def install(cls, loop: asyncio.AbstractEventLoop):
+        """Stamp every task created from now on so /profile tasks can report its age."""
+        cls._loop_thread_id = threading.get_ident()
+
+        def factory(loop, coro, **kwargs):
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+            cls._task_born[task] = time.monotonic()
+            return task
+
+        loop.set_task_factory(factory)
+
+    @classmethod
+    def set_loop_debug(cls, enabled: bool, slow_ms: float = 100) -> str:
+        loop = asyncio.get_running_loop()
+        loop.set_debug(enabled)
+        loop.slow_callback_duration = slow_ms / 1000
+        asyncio_logger = logging.getLogger("asyncio")
+        if enabled:
+            # Slow-callback reports are warnings on the asyncio logger; keep debug-mode chatter out
+            if cls._asyncio_log_level is None:
+                cls._asyncio_log_level = asyncio_logger.level
+            asyncio_logger.setLevel(logging.WARNING)
+            return f"Loop debug ON: callbacks slower than {slow_ms:.0f}ms are logged."
+        if cls._asyncio_log_level is not None:
+            asyncio_logger.setLevel(cls._asyncio_log_level)
+            cls._asyncio_log_level = None
+        return "Loop debug OFF."
+
+    @classmethod
+    def sample_cpu(cls, seconds: float, interval: float = 0.005) -> str:
+        """Sample the event-loop thread's stack; run in a worker thread."""
+        own, cumulative, stacks = Counter(), Counter(), Counter()
+        samples = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(cls._loop_thread_id)
+            if frame is not None:
+                samples += 1
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                own[stack[0]] += 1
+                for func in {entry.rsplit(":", 1)[0] for entry in stack}:
+                    cumulative[func] += 1
+                stacks[" <- ".join(stack[:8])] += 1
+            time.sleep(interval)
+
+        lines = [f"CPU sample of event-loop thread: {samples} samples over {seconds:.0f}s "
+                 f"(every {interval * 1000:.0f}ms)", "", "Own (leaf line):"]
+        lines += [f"{100 * n / samples:6.1f}%  {name}" for name, n in own.most_common(25)] if samples else []
+        lines += ["", "Cumulative (function on stack):"]
+        lines += [f"{100 * n / samples:6.1f}%  {name}" for name, n in cumulative.most_common(25)] if samples else []
+        lines += ["", "Top stacks (innermost first):"]
+        lines += [f"{n:6d}  {stack}" for stack, n in stacks.most_common(10)]
+        return "\n".join(lines)
+
+    @classmethod
+    def memory_report(cls, limit: int = 25) -> str:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+            return "tracemalloc started (10 frames). Run /profile mem again later for a report."
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"Traced memory: current {current / 1e6:.1f} MB, peak {peak / 1e6:.1f} MB", "",
+                 f"Top {limit} allocation sites:"]
+        lines += [str(stat) for stat in snapshot.statistics("lineno")[:limit]]
+        if cls._last_snapshot is not None:
+            lines += ["", f"Top {limit} changes since previous report:"]
+            lines += [str(stat) for stat in snapshot.compare_to(cls._last_snapshot, "lineno")[:limit]]
+        cls._last_snapshot = snapshot
+        return "\n".join(lines)
+
+    @classmethod
+    def stop_memory(cls) -> str:
+        tracemalloc.stop()
+        cls._last_snapshot = None
+        return "tracemalloc stopped."
+
+    @classmethod
+    def tasks_report(cls) -> str:
+        now = time.monotonic()
+        tasks = [t for t in asyncio.all_tasks() if not t.done()]
+        ages = {t: now - cls._task_born[t] if t in cls._task_born else None for t in tasks}
+        tasks.sort(key=lambda t: -1 if ages[t] is None else ages[t], reverse=True)
+        lines = [f"{len(tasks)} pending task(s), oldest first (age '?' = created before tracking)", ""]
+        for t in tasks:
+            age = "?" if ages[t] is None else f"{ages[t]:.1f}s"
+            coro = t.get_coro()
+            where = ""
+            stack = t.get_stack(limit=1)
+            if stack:
+                where = f" @ {os.path.basename(stack[0].f_code.co_filename)}:{stack[0].f_lineno}"
+            lines.append(f"{age:>10}  {t.get_name():<20} {getattr(coro, '__qualname__', coro)}{where}")
+        return "\n".join(lines)
+
+# ---------- Outbound Send Queue ----------
+LANE_REPLY = 0   # lookup and command replies
+LANE_BULK = 1    # broadcasts and bulk DMs; only sent when no reply is waiting
+OUTBOX_MAX_ATTEMPTS = 3
+TELEGRAM_MAX_TEXT = 4096
+
+class TokenBucket:
+    """`rate` tokens per second, bursting up to `burst`; can be blocked outright after a RetryAfter."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Seconds until one token is available (0 if available now)."""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.blocked_until - now)
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst and now >= self.blocked_until
+
+
+class _Send:
+    """One queued Bot API call. `text` is passed positionally so queued texts can be merged."""
+
+    def __init__(self, chat_id: int, method, text: Optional[str], kwargs: dict, lane: int, merge_key):
+        self.chat_id = chat_id
+        self.method = method
+        self.text = text
+        self.kwargs = kwargs
+        self.lane = lane
+        self.merge_key = merge_key
+        self.attempts = 0
+        # One future per caller, so cancelling one merged caller does not affect the others
+        self.waiters: List[asyncio.Future] = []
+
+    def add_waiter(self) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append(future)
+        return future
+
+    def resolve(self, result):
+        for future in self.waiters:
+            if not future.done():
+                future.set_result(result)
+
+    def fail(self, exc: BaseException):
+        for future in self.waiters:
+            if not future.done():
+                future.set_exception(exc)
+
+    def can_merge(self, text: str, kwargs: dict, merge_key) -> bool:
+        return (self.merge_key is not None and self.merge_key == merge_key
+                and self.text is not None and self.kwargs == kwargs
+                and "reply_markup" not in kwargs
+                and len(self.text) + 2 + len(text) <= TELEGRAM_MAX_TEXT)
+
+
+class Outbox:
+    """Central scheduler for every outgoing message.
+
+    Sends are paced by a global token bucket and a per-chat bucket (Telegram allows
+    ~1 msg/s per private chat and ~20 msg/min per group). RetryAfter pushes the chat
+    back and pauses the bulk lane, then the send is retried. Reply-lane sends always go
+    before bulk sends. Consecutive texts queued for the same reply target are merged.
+    """
+    _lanes = (deque(), deque())
+    _chats: Dict[int, TokenBucket] = {}
+    _busy: set = set()  # chats with a send in flight (keeps per-chat ordering)
+    _global: TokenBucket = None
+    _bulk_paused_until = 0.0
+    _wakeup: asyncio.Event = None
+    _slots: asyncio.Semaphore = None
+    _dispatcher: asyncio.Task = None
+    _inflight: set = set()
+    _stopping = False
+
+    @classmethod
+    def start(cls):
+        cls._stopping = False
+        cls._global = TokenBucket(OUTBOX_GLOBAL_RATE, OUTBOX_GLOBAL_RATE)
+        cls._wakeup = asyncio.Event()
+        cls._slots = asyncio.Semaphore(OUTBOX_CONCURRENCY)
+        cls._dispatcher = asyncio.create_task(cls._dispatch(), name="outbox")
+
+    @classmethod
+    async def stop(cls):
+        """Cancel the dispatcher, let in-flight sends finish and fail whatever is still queued."""
+        cls._stopping = True
+        if cls._dispatcher:
+            cls._dispatcher.cancel()
+            await asyncio.gather(cls._dispatcher, return_exceptions=True)
+            cls._dispatcher = None
+        # In-flight sends no longer requeue on RetryAfter, so this always completes
+        await asyncio.gather(*cls._inflight, return_exceptions=True)
+        for lane in cls._lanes:
+            while lane:
+                lane.popleft().fail(RuntimeError("Outbox stopped"))
+
+    @classmethod
+    def submit(cls, chat_id: int, method, text: Optional[str] = None, kwargs: dict = None,
+               lane: int = LANE_REPLY, merge_key=None) -> asyncio.Future:
+        """Queue `method(text, **kwargs)` (or `method(**kwargs)`); the future resolves to its result."""
+        kwargs = kwargs or {}
+        if text is not None and merge_key is not None:
+            for job in reversed(cls._lanes[lane]):
+                if job.chat_id != chat_id:
+                    continue
+                if job.can_merge(text, kwargs, merge_key):
+                    job.text += "\n\n" + text
+                    return job.add_waiter()
+                break
+        job = _Send(chat_id, method, text, kwargs, lane, merge_key)
+        future = job.add_waiter()
+        cls._lanes[lane].append(job)
+        cls._wakeup.set()
+        return future
+
+    @classmethod
+    def _chat_bucket(cls, chat_id: int) -> TokenBucket:
+        bucket = cls._chats.get(chat_id)
+        if bucket is None:
+            # Negative ids are groups/channels
+            bucket = TokenBucket(20 / 60, 5) if chat_id < 0 else TokenBucket(1, 3)
+            cls._chats[chat_id] = bucket
+        return bucket
+
+    @classmethod
+    def _next_job(cls, now: float) -> (Optional[_Send], Optional[float]):
+        """Highest-priority job whose chat is free; otherwise how long until one could be."""
+        wait = None
+        for lane_id, lane in enumerate(cls._lanes):
+            if lane_id == LANE_BULK and now < cls._bulk_paused_until:
+                if lane:
+                    wait = cls._bulk_paused_until - now if wait is None else min(wait, cls._bulk_paused_until - now)
+                continue
+            for i, job in enumerate(lane):
+                if job.chat_id in cls._busy:
+                    continue
+                delay = cls._chat_bucket(job.chat_id).delay(now)
+                if delay <= 0:
+                    del lane[i]
+                    return job, None
+                wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    @classmethod
+    async def _dispatch(cls):
+        loop = asyncio.get_running_loop()
+        last_prune = loop.time()
+        while True:
+            # Reserve a send slot and a global token before taking a job off its lane, so a
+            # cancellation (Outbox.stop) never catches a job that is neither queued nor in flight
+            await cls._slots.acquire()
+            try:
+                delay = cls._global.delay(time.monotonic())
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                cls._slots.release()
+                raise
+            now = time.monotonic()
+            job, wait = cls._next_job(now)
+            if job is None:
+                cls._slots.release()
+                cls._wakeup.clear()
+                try:
+                    await asyncio.wait_for(cls._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            # No await from here until the job is tracked in _inflight (its task releases the slot)
+            cls._global.take(now)
+            cls._chat_bucket(job.chat_id).take(now)
+            cls._busy.add(job.chat_id)
+            task = asyncio.create_task(cls._send(job))
+            cls._inflight.add(task)
+            task.add_done_callback(cls._inflight.discard)
+            if loop.time() - last_prune > 60:
+                last_prune = loop.time()
+                for chat_id in [c for c, b in cls._chats.items() if c not in cls._busy and b.idle(now)]:
+                    del cls._chats[chat_id]
+
+    @classmethod
+    async def _send(cls, job: _Send):
+        try:
+            if job.text is not None:
+                result = await job.method(job.text, **job.kwargs)
+            else:
+                result = await job.method(**job.kwargs)
+        except RetryAfter as e:
+            delay = e.retry_after.total_seconds() if isinstance(e.retry_after, timedelta) else float(e.retry_after)
+            now = time.monotonic()
+            cls._chat_bucket(job.chat_id).blocked_until = now + delay
+            cls._bulk_paused_until = max(cls._bulk_paused_until, now + delay)
+            job.attempts += 1
+            logger.warning(f"Flood control for chat {job.chat_id}: retry in {delay:.0f}s (attempt {job.attempts})")
+            if job.attempts < OUTBOX_MAX_ATTEMPTS and not cls._stopping:
+                cls._lanes[job.lane].appendleft(job)
+            else:
+                job.fail(e)
+        except Exception as e:
+            job.fail(e)
+        else:
+            job.resolve(result)
+        finally:
+            cls._busy.discard(job.chat_id)
+            cls._slots.release()
+            cls._wakeup.set()
+
+
+async def reply(update: Update, text: str, lane: int = LANE_REPLY, **kwargs):
+    """Reply to the update's message through the Outbox."""
+    msg = update.effective_message
+    return await Outbox.submit(msg.chat_id, msg.reply_text, text, kwargs, lane,
+                               merge_key=(msg.chat_id, msg.message_id))
+
+async def reply_document(update: Update, lane: int = LANE_REPLY, **kwargs):
+    msg = update.effective_message
+    return await Outbox.submit(msg.chat_id, msg.reply_document, None, kwargs, lane)
+
+async def send_text(bot, chat_id: int, text: str, lane: int = LANE_REPLY, **kwargs):
+    return await Outbox.submit(chat_id, functools.partial(bot.send_message, chat_id), text, kwargs, lane,
+                               merge_key=(chat_id, None))
+
+async def copy_to(bot, chat_id: int, from_chat_id: int, message_id: int, lane: int = LANE_REPLY):
+    return await Outbox.submit(chat_id, bot.copy_message, None,
+                               {"chat_id": chat_id, "from_chat_id": from_chat_id, "message_id": message_id},
+                               lane)
+
 # ---------- FastAPI & Telegram App ----------
 app = FastAPI()
 telegram_app = Application.builder().token(BOT_TOKEN).build()
@@ -275,12 +1089,17 @@ async def is_admin_or_owner(user_id: int) -> bool:
     """Check if user is in DB as admin or is owner."""
     if user_id == OWNER_ID:
         return True
-    user = await Database.get_user(user_id)
-    return user and user.get("is_admin") == 1
+    return await Database.is_admin(user_id)
+
+async def check_force_channels(user_id: int, context: ContextTypes.DEFAULT_TYPE,
+                               is_admin: Optional[bool] = None) -> (bool, str):
+    """Return (ok, message). If not ok, message contains instruction.
 
-async def check_force_channels(user_id: int, context: ContextTypes.DEFAULT_TYPE) -> (bool, str):
-    """Return (ok, message). If not ok, message contains instruction."""
-    if user_id == OWNER_ID or await is_admin_or_owner(user_id):
+    Pass `is_admin` when it is already known to skip the extra DB lookup.
+    """
+    if is_admin is None:
+        is_admin = await is_admin_or_owner(user_id)
+    if user_id == OWNER_ID or is_admin:
         return True, ""
     try:
         member1 = await context.bot.get_chat_member(FORCE_CHANNEL1_ID, user_id)
@@ -299,6 +1118,16 @@ async def check_force_channels(user_id: int, context: ContextTypes.DEFAULT_TYPE)
 
 async def fetch_api(url: str, params: dict = None) -> dict:
     """Fetch JSON from API with timeout."""
+    host = urlparse(url).hostname or url
+    Primer.note_demand(host)
+    start = time.perf_counter()
+    result = await _fetch_json(url, params)
+    Telemetry.record_upstream(host, (time.perf_counter() - start) * 1000, "error" not in result)
+    if "error" not in result:
+        Primer.note_contact(host)
+    return result
+
+async def _fetch_json(url: str, params: dict = None) -> dict:
     async with aiohttp.ClientSession() as session:
         try:
             async with session.get(url, params=params, timeout=10) as resp:
@@ -311,6 +1140,68 @@ async def fetch_api(url: str, params: dict = None) -> dict:
         except Exception as e:
             return {"error": str(e)}
 
+class Primer:
+    """Keeps slow cold-starting upstreams warm, but only while users are actually calling them."""
+    _last_demand: Dict[str, float] = {}
+    _last_contact: Dict[str, float] = {}
+    _task: asyncio.Task = None
+
+    @classmethod
+    def note_demand(cls, host: str):
+        if host.endswith(PRIME_HOST_SUFFIXES):
+            cls._last_demand[host] = time.monotonic()
+
+    @classmethod
+    def note_contact(cls, host: str):
+        if host in cls._last_demand:
+            cls._last_contact[host] = time.monotonic()
+
+    @classmethod
+    def start(cls):
+        if PRIME_HOST_SUFFIXES and PRIME_MAX_PROBES > 0:
+            cls._task = asyncio.create_task(cls._run(), name="primer")
+
+    @classmethod
+    async def stop(cls):
+        if cls._task:
+            cls._task.cancel()
+            await asyncio.gather(cls._task, return_exceptions=True)
+            cls._task = None
+
+    @classmethod
+    def due_hosts(cls) -> List[str]:
+        """Hosts with recent demand that have gone quiet, most recently demanded first."""
+        now = time.monotonic()
+        due = [
+            host for host, demanded in cls._last_demand.items()
+            if now - demanded <= PRIME_DEMAND_WINDOW
+            and now - cls._last_contact.get(host, 0) >= PRIME_IDLE_AFTER
+        ]
+        due.sort(key=lambda h: cls._last_demand[h], reverse=True)
+        return due[:PRIME_MAX_PROBES]
+
+    @classmethod
+    async def _run(cls):
+        while True:
+            await asyncio.sleep(PRIME_INTERVAL)
+            hosts = cls.due_hosts()
+            if hosts:
+                await asyncio.gather(*(cls._probe(h) for h in hosts))
+
+    @classmethod
+    async def _probe(cls, host: str):
+        # Any HTTP response means the instance is up; a cold start can take close to a minute
+        start = time.perf_counter()
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f"https://{host}/", timeout=aiohttp.ClientTimeout(total=90)) as resp:
+                    status = resp.status
+        except Exception as e:
+            logger.warning(f"Keep-warm probe to {host} failed: {e!r}")
+            return
+        cls._last_contact[host] = time.monotonic()
+        logger.info(f"Keep-warm probe to {host}: HTTP {status} in {time.perf_counter() - start:.1f}s")
+
 def clean_branding(data: Union[dict, list, str], extra_blacklist: list = None) -> Union[dict, list, str]:
     """Recursively remove any blacklisted strings from JSON data."""
     blacklist = BRANDING_BLACKLIST + (extra_blacklist or [])
@@ -348,14 +1239,14 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     if update.effective_chat.type == "private":
         # Private chat: suggest group bot
-        await update.message.reply_text(
+        await reply(update, 
             "🤖 **This bot only works in groups.**\n"
             "Please add me to a group or use @osintfatherNullBot for personal use.",
             parse_mode=ParseMode.MARKDOWN
         )
         return
     # Group: welcome message
-    await update.message.reply_text(
+    await reply(update, 
         "✅ Bot is active!\nUse /help to see all commands.",
         parse_mode=ParseMode.MARKDOWN
     )
@@ -398,19 +1289,24 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 Admin commands are hidden.
 """
-    await update.message.reply_text(help_text, parse_mode=ParseMode.MARKDOWN)
+    await reply(update, help_text, parse_mode=ParseMode.MARKDOWN)
 
 # Generic API command factory
 def make_api_handler(api_url_template, input_processor=None, extra_branding_blacklist=None):
     """Create a command handler for a given API."""
     async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
-        await Database.add_or_update_user(user.id, user.username, user.first_name, user.last_name)
+        Telemetry.record_command(context.command[0])
+        Tracer.annotate(command=context.command[0], user_id=user.id)
+        # Upsert + admin flag in a single round-trip
+        with Tracer.span("db_user"):
+            state = await Database.touch_user(user.id, user.username, user.first_name, user.last_name)
+        is_admin = user.id == OWNER_ID or state["is_admin"] == 1
         chat = update.effective_chat
 
         # Private chat restriction
-        if chat.type == "private" and not await is_admin_or_owner(user.id):
-            await update.message.reply_text(
+        if chat.type == "private" and not is_admin:
+            await reply(update, 
                 "❌ **This bot only works in groups.**\n"
                 "Try @osintfatherNullBot for personal use.",
                 parse_mode=ParseMode.MARKDOWN
@@ -419,15 +1315,16 @@ def make_api_handler(api_url_template, input_processor=None, extra_branding_blac
 
         # Force channel check for group users (except admins)
         if chat.type in ["group", "supergroup"]:
-            ok, msg = await check_force_channels(user.id, context)
+            with Tracer.span("force_check"):
+                ok, msg = await check_force_channels(user.id, context, is_admin)
             if not ok:
-                await update.message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
+                await reply(update, msg, parse_mode=ParseMode.MARKDOWN)
                 return
 
         # Extract argument
         args = context.args
         if not args:
-            await update.message.reply_text(f"Usage: /{context.command[0]} <input>")
+            await reply(update, f"Usage: /{context.command[0]} <input>")
             return
         inp = " ".join(args)
         if input_processor:
@@ -437,23 +1334,27 @@ def make_api_handler(api_url_template, input_processor=None, extra_branding_blac
         url = api_url_template.format(input=inp)
 
         # Fetch
-        raw_data = await fetch_api(url)
+        with Tracer.span("upstream"):
+            raw_data = await fetch_api(url)
         if "error" in raw_data:
-            await update.message.reply_text(f"⚠️ API error: {raw_data['error']}")
+            Tracer.annotate(upstream_error=raw_data['error'])
+            await reply(update, f"⚠️ API error: {raw_data['error']}")
             return
 
-        # Clean branding
-        cleaned = clean_branding(raw_data, extra_blacklist=extra_branding_blacklist)
-        output = format_json_output(cleaned, context.command[0])
+        with Tracer.span("format"):
+            # Clean branding
+            cleaned = clean_branding(raw_data, extra_blacklist=extra_branding_blacklist)
+            output = format_json_output(cleaned, context.command[0])
 
-        # Truncate if too long (Telegram max 4096)
-        if len(output) > 4000:
-            output = output[:4000] + "\n... (truncated)"
+            # Truncate if too long (Telegram max 4096)
+            if len(output) > 4000:
+                output = output[:4000] + "\n... (truncated)"
 
-        await update.message.reply_text(output, parse_mode=ParseMode.MARKDOWN)
+        # Record lookup (off the reply path, and even if the reply fails; shutdown drains it)
+        Lifecycle.spawn(Database.add_lookup(user.id, context.command[0], inp, cleaned), name="add_lookup")
 
-        # Record lookup
-        await Database.add_lookup(user.id, context.command[0], inp, json.dumps(cleaned)[:200])
+        with Tracer.span("reply"):
+            await reply(update, output, parse_mode=ParseMode.MARKDOWN)
 
     return handler
 
@@ -492,29 +1393,24 @@ async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin_filter(update, context):
         return
     if not update.message.reply_to_message:
-        await update.message.reply_text("Reply to a message with /broadcast to send it to all users.")
+        await reply(update, "Reply to a message with /broadcast to send it to all users.")
         return
 
     users = await Database.get_all_users(include_banned=False)
-    sent = 0
-    failed = 0
-    for u in users:
-        try:
-            await context.bot.copy_message(
-                chat_id=u['user_id'],
-                from_chat_id=update.chat_id,
-                message_id=update.message.reply_to_message.message_id
-            )
-            sent += 1
-        except Exception as e:
-            failed += 1
-    await update.message.reply_text(f"Broadcast completed. Sent: {sent}, Failed: {failed}")
+    results = await asyncio.gather(*(
+        copy_to(context.bot, u['user_id'], update.effective_chat.id,
+                update.message.reply_to_message.message_id, lane=LANE_BULK)
+        for u in users
+    ), return_exceptions=True)
+    failed = sum(isinstance(r, Exception) for r in results)
+    sent = len(results) - failed
+    await reply(update, f"Broadcast completed. Sent: {sent}, Failed: {failed}")
 
 async def dm_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin_filter(update, context):
         return
     if not context.args and not update.message.reply_to_message:
-        await update.message.reply_text("Usage: /dm <user_id> <text> or reply to a message with /dm <user_id>")
+        await reply(update, "Usage: /dm <user_id> <text> or reply to a message with /dm <user_id>")
         return
 
     target_id = None
@@ -525,123 +1421,185 @@ async def dm_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.reply_to_message:
         target_id = int(context.args[0]) if context.args else None
         if not target_id:
-            await update.message.reply_text("Please provide user ID when replying.")
+            await reply(update, "Please provide user ID when replying.")
             return
         try:
-            await context.bot.copy_message(
-                chat_id=target_id,
-                from_chat_id=update.chat_id,
-                message_id=update.message.reply_to_message.message_id
-            )
-            await update.message.reply_text(f"Message sent to {target_id}.")
+            await copy_to(context.bot, target_id, update.effective_chat.id,
+                          update.message.reply_to_message.message_id)
+            await reply(update, f"Message sent to {target_id}.")
         except Exception as e:
-            await update.message.reply_text(f"Failed: {e}")
+            await reply(update, f"Failed: {e}")
         return
     if text and target_id:
         try:
-            await context.bot.send_message(chat_id=target_id, text=text)
-            await update.message.reply_text(f"Message sent to {target_id}.")
+            await send_text(context.bot, target_id, text)
+            await reply(update, f"Message sent to {target_id}.")
         except Exception as e:
-            await update.message.reply_text(f"Failed: {e}")
+            await reply(update, f"Failed: {e}")
 
 async def bulk_dm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin_filter(update, context):
         return
     if not context.args and not update.message.reply_to_message:
-        await update.message.reply_text("Usage: /bulkdm id1,id2,... <text> or reply with /bulkdm id1,id2,...")
+        await reply(update, "Usage: /bulkdm id1,id2,... <text> or reply with /bulkdm id1,id2,...")
         return
     args = context.args
     if not args:
-        await update.message.reply_text("Provide at least IDs.")
+        await reply(update, "Provide at least IDs.")
         return
     ids_part = args[0]
     text = " ".join(args[1:]) if len(args) > 1 else None
     try:
         ids = [int(x.strip()) for x in ids_part.split(",")]
     except:
-        await update.message.reply_text("Invalid ID list. Use comma separated numbers.")
+        await reply(update, "Invalid ID list. Use comma separated numbers.")
         return
     if update.message.reply_to_message:
-        sent = 0
-        failed = 0
-        for uid in ids:
-            try:
-                await context.bot.copy_message(
-                    chat_id=uid,
-                    from_chat_id=update.chat_id,
-                    message_id=update.message.reply_to_message.message_id
-                )
-                sent += 1
-            except:
-                failed += 1
-        await update.message.reply_text(f"Bulk DM completed. Sent: {sent}, Failed: {failed}")
+        results = await asyncio.gather(*(
+            copy_to(context.bot, uid, update.effective_chat.id,
+                    update.message.reply_to_message.message_id, lane=LANE_BULK)
+            for uid in ids
+        ), return_exceptions=True)
+        failed = sum(isinstance(r, Exception) for r in results)
+        sent = len(results) - failed
+        await reply(update, f"Bulk DM completed. Sent: {sent}, Failed: {failed}")
     elif text:
-        sent = 0
-        failed = 0
-        for uid in ids:
-            try:
-                await context.bot.send_message(chat_id=uid, text=text)
-                sent += 1
-            except:
-                failed += 1
-        await update.message.reply_text(f"Bulk DM completed. Sent: {sent}, Failed: {failed}")
+        results = await asyncio.gather(*(
+            send_text(context.bot, uid, text, lane=LANE_BULK) for uid in ids
+        ), return_exceptions=True)
+        failed = sum(isinstance(r, Exception) for r in results)
+        sent = len(results) - failed
+        await reply(update, f"Bulk DM completed. Sent: {sent}, Failed: {failed}")
     else:
-        await update.message.reply_text("Provide text or reply to a message.")
+        await reply(update, "Provide text or reply to a message.")
 
 async def ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin_filter(update, context):
         return
     if not context.args:
-        await update.message.reply_text("Usage: /ban <user_id>")
+        await reply(update, "Usage: /ban <user_id>")
         return
     try:
         uid = int(context.args[0])
         await Database.set_ban(uid, True)
-        await update.message.reply_text(f"User {uid} banned.")
+        await reply(update, f"User {uid} banned.")
     except:
-        await update.message.reply_text("Invalid ID.")
+        await reply(update, "Invalid ID.")
 
 async def unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin_filter(update, context):
         return
     if not context.args:
-        await update.message.reply_text("Usage: /unban <user_id>")
+        await reply(update, "Usage: /unban <user_id>")
         return
     try:
         uid = int(context.args[0])
         await Database.set_ban(uid, False)
-        await update.message.reply_text(f"User {uid} unbanned.")
+        await reply(update, f"User {uid} unbanned.")
     except:
-        await update.message.reply_text("Invalid ID.")
+        await reply(update, "Invalid ID.")
 
 async def delete_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin_filter(update, context):
         return
     if not context.args:
-        await update.message.reply_text("Usage: /deleteuser <user_id>")
+        await reply(update, "Usage: /deleteuser <user_id>")
         return
     try:
         uid = int(context.args[0])
         await Database.delete_user(uid)
-        await update.message.reply_text(f"User {uid} deleted.")
+        await reply(update, f"User {uid} deleted.")
     except:
-        await update.message.reply_text("Invalid ID or error.")
+        await reply(update, "Invalid ID or error.")
+
+MAX_BULK_FILE_SIZE = 1024 * 1024
+
+def parse_user_ids(text: str) -> (List[int], int):
+    """Parse IDs from a comma/whitespace separated list or a CSV export.
+
+    For CSV with a header, the `user_id` column is used; otherwise the first column.
+    Returns (unique ids in input order, number of invalid entries).
+    """
+    rows = [r for r in csv.reader(io.StringIO(text)) if any(c.strip() for c in r)]
+    header = [c.strip().lower() for c in rows[0]] if rows else []
+    if "user_id" in header:
+        col = header.index("user_id")
+        values = [r[col] for r in rows[1:] if len(r) > col]
+    elif len(rows) > 1 and any(len(r) > 1 for r in rows):
+        values = [r[0] for r in rows]
+    else:
+        values = re.split(r"[,\s]+", text)
+    ids, invalid = [], 0
+    for v in values:
+        v = v.strip()
+        if not v:
+            continue
+        # ASCII digits only (isdigit() also accepts e.g. '²') and within BIGINT range
+        if v.isascii() and v.isdigit() and int(v) < 2 ** 63:
+            ids.append(int(v))
+        else:
+            invalid += 1
+    return list(dict.fromkeys(ids)), invalid
+
+async def read_bulk_ids(update: Update, context: ContextTypes.DEFAULT_TYPE) -> (List[int], int):
+    """IDs from the command arguments, or from the CSV/text document the command replies to."""
+    replied = update.message.reply_to_message
+    if replied and replied.document:
+        if replied.document.file_size and replied.document.file_size > MAX_BULK_FILE_SIZE:
+            raise ValueError("File too large (max 1 MB).")
+        file = await replied.document.get_file()
+        data = await file.download_as_bytearray()
+        return parse_user_ids(data.decode("utf-8", errors="replace"))
+    return parse_user_ids(" ".join(context.args or []))
+
+def make_bulk_handler(command: str, action, done_label: str):
+    """Admin command applying `action(ids)` to IDs given inline or in a replied-to CSV."""
+    async def handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not await is_admin_filter(update, context):
+            return
+        try:
+            ids, invalid = await read_bulk_ids(update, context)
+        except ValueError as e:
+            await reply(update, str(e))
+            return
+        if not ids:
+            await reply(update, f"Usage: /{command} id1,id2,... or reply to a CSV file with /{command}")
+            return
+        try:
+            affected = await action(ids)
+        except Exception as e:
+            logger.error(f"/{command} failed: {e}")
+            await reply(update, f"Failed, nothing was changed: {e}")
+            return
+        missing = sorted(set(ids) - set(affected))
+        msg = f"{done_label} {len(affected)} of {len(ids)} user(s)."
+        if missing:
+            preview = ", ".join(str(x) for x in missing[:20])
+            msg += f"\nNot found ({len(missing)}): {preview}{' ...' if len(missing) > 20 else ''}"
+        if invalid:
+            msg += f"\nSkipped {invalid} invalid entr{'y' if invalid == 1 else 'ies'}."
+        await reply(update, msg)
+    return handler
+
+bulk_ban = make_bulk_handler("bulkban", lambda ids: Database.set_ban_many(ids, True), "Banned")
+bulk_unban = make_bulk_handler("bulkunban", lambda ids: Database.set_ban_many(ids, False), "Unbanned")
+bulk_delete = make_bulk_handler("bulkdelete", Database.delete_users, "Deleted")
 
 async def search_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin_filter(update, context):
         return
     if not context.args:
-        await update.message.reply_text("Usage: /searchuser <query> (username or name)")
+        await reply(update, "Usage: /searchuser <query> (username or name)")
         return
     query = " ".join(context.args)
     rows = await Database.search_users(query)
     if not rows:
-        await update.message.reply_text("No users found.")
+        await reply(update, "No users found.")
         return
     msg = "**Search Results:**\n"
     for u in rows:
         msg += f"🆔 `{u['user_id']}` | @{u.get('username','')} | {u.get('first_name','')} | Banned: {u['is_banned']}\n"
-    await update.message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
+    await reply(update, msg, parse_mode=ParseMode.MARKDOWN)
 
 async def list_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin_filter(update, context):
@@ -658,7 +1616,7 @@ async def list_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     for r in rows:
         u = dict(r)
         msg += f"🆔 `{u['user_id']}` | @{u.get('username','')} | {u.get('first_name','')} | Banned: {u['is_banned']}\n"
-    await update.message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
+    await reply(update, msg, parse_mode=ParseMode.MARKDOWN)
 
 async def recent_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin_filter(update, context):
@@ -672,27 +1630,43 @@ async def recent_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
         msg += f"🆔 `{u['user_id']}` | Last active: {u['last_activity'][:16] if u['last_activity'] else 'Never'}\n"
     if len(rows) > 10:
         msg += f"... and {len(rows)-10} more"
-    await update.message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
+    await reply(update, msg, parse_mode=ParseMode.MARKDOWN)
 
 async def user_lookups(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin_filter(update, context):
         return
     if not context.args:
-        await update.message.reply_text("Usage: /userlookups <user_id>")
+        await reply(update, "Usage: /userlookups <user_id>")
         return
     try:
         uid = int(context.args[0])
     except:
-        await update.message.reply_text("Invalid ID.")
+        await reply(update, "Invalid ID.")
         return
     lookups = await Database.get_user_lookups(uid, 20)
     if not lookups:
-        await update.message.reply_text("No lookups found.")
+        await reply(update, "No lookups found.")
         return
     msg = f"**Last lookups for {uid}:**\n"
     for l in lookups:
-        msg += f"• `{l['command']}` `{l['input']}` at {l['timestamp'][:16]}\n"
-    await update.message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
+        msg += f"• #{l['id']} `{l['command']}` `{l['input']}` at {str(l['timestamp'])[:16]}\n"
+    msg += "Use /lookupresult <id> for the full result."
+    await reply(update, msg, parse_mode=ParseMode.MARKDOWN)
+
+async def lookup_result(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_admin_filter(update, context):
+        return
+    if not context.args or not context.args[0].lstrip('#').isdigit():
+        await reply(update, "Usage: /lookupresult <lookup_id>")
+        return
+    lookup_id = int(context.args[0].lstrip('#'))
+    result = await Database.get_lookup_result(lookup_id)
+    if result is None:
+        await reply(update, "Lookup not found.")
+        return
+    data = json.dumps(result, indent=2, ensure_ascii=False).encode()
+    await reply_document(update, document=data, filename=f"lookup_{lookup_id}.json",
+                         caption=f"Result of lookup #{lookup_id}")
 
 async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin_filter(update, context):
@@ -703,7 +1677,7 @@ async def leaderboard(update: Update, context: ContextTypes.DEFAULT_TYPE):
         u = await Database.get_user(r['user_id'])
         name = f"@{u['username']}" if u and u.get('username') else str(r['user_id'])
         msg += f"{i}. {name} – {r['cnt']} lookups\n"
-    await update.message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
+    await reply(update, msg, parse_mode=ParseMode.MARKDOWN)
 
 async def inactive_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin_filter(update, context):
@@ -712,7 +1686,7 @@ async def inactive_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.args and context.args[0].isdigit():
         days = int(context.args[0])
     cnt = await Database.get_inactive_count(days)
-    await update.message.reply_text(f"Inactive users (no activity in last {days} days): {cnt}")
+    await reply(update, f"Inactive users (no activity in last {days} days): {cnt}")
 
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin_filter(update, context):
@@ -723,7 +1697,7 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
            f"🚫 Banned: {banned}\n"
            f"📊 Total lookups: {total_lookups}\n"
            f"📈 Active users (ever used): {active_users}")
-    await update.message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
+    await reply(update, msg, parse_mode=ParseMode.MARKDOWN)
 
 async def dailystats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin_filter(update, context):
@@ -735,7 +1709,7 @@ async def dailystats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = "**Daily Lookups (last {} days):**\n".format(days)
     for day, cnt in reversed(data):
         msg += f"{day}: {cnt}\n"
-    await update.message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
+    await reply(update, msg, parse_mode=ParseMode.MARKDOWN)
 
 async def lookupstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin_filter(update, context):
@@ -744,7 +1718,7 @@ async def lookupstats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     msg = "**Lookup statistics per command:**\n"
     for cmd, cnt in rows:
         msg += f"/{cmd}: {cnt}\n"
-    await update.message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
+    await reply(update, msg, parse_mode=ParseMode.MARKDOWN)
 
 async def backup(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin_filter(update, context):
@@ -752,7 +1726,7 @@ async def backup(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Generate CSV of all users
     users = await Database.get_all_users(include_banned=True)
     if not users:
-        await update.message.reply_text("No users to backup.")
+        await reply(update, "No users to backup.")
         return
     output = io.StringIO()
     writer = csv.writer(output)
@@ -761,7 +1735,7 @@ async def backup(update: Update, context: ContextTypes.DEFAULT_TYPE):
     for u in users:
         writer.writerow(u.values())
     csv_data = output.getvalue().encode()
-    await update.message.reply_document(document=csv_data, filename="users_backup.csv", caption="Users backup")
+    await reply_document(update, document=csv_data, filename="users_backup.csv", caption="Users backup")
 
 async def fulldbbackup(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin_filter(update, context):
@@ -776,7 +1750,7 @@ async def fulldbbackup(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for u in users:
             writer.writerow(u.values())
         csv_data = output.getvalue().encode()
-        await update.message.reply_document(document=csv_data, filename="users_export.csv", caption="Users CSV")
+        await reply_document(update, document=csv_data, filename="users_export.csv", caption="Users CSV")
 
     # Lookups CSV (last 1000 for size)
     async with Database._pool.acquire() as conn:
@@ -786,37 +1760,37 @@ async def fulldbbackup(update: Update, context: ContextTypes.DEFAULT_TYPE):
         writer = csv.writer(output)
         writer.writerow(rows[0].keys())
         for r in rows:
-            writer.writerow(r.values())
+            writer.writerow([v.hex() if isinstance(v, bytes) else v for v in r.values()])
         csv_data = output.getvalue().encode()
-        await update.message.reply_document(document=csv_data, filename="lookups_export.csv", caption="Lookups CSV (last 1000)")
+        await reply_document(update, document=csv_data, filename="lookups_export.csv", caption="Lookups CSV (last 1000)")
 
 async def add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != OWNER_ID:
-        await update.message.reply_text("Only owner can add admins.")
+        await reply(update, "Only owner can add admins.")
         return
     if not context.args:
-        await update.message.reply_text("Usage: /addadmin <user_id>")
+        await reply(update, "Usage: /addadmin <user_id>")
         return
     try:
         uid = int(context.args[0])
         await Database.set_admin(uid, True)
-        await update.message.reply_text(f"User {uid} is now admin.")
+        await reply(update, f"User {uid} is now admin.")
     except:
-        await update.message.reply_text("Invalid ID.")
+        await reply(update, "Invalid ID.")
 
 async def remove_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != OWNER_ID:
-        await update.message.reply_text("Only owner can remove admins.")
+        await reply(update, "Only owner can remove admins.")
         return
     if not context.args:
-        await update.message.reply_text("Usage: /removeadmin <user_id>")
+        await reply(update, "Usage: /removeadmin <user_id>")
         return
     try:
         uid = int(context.args[0])
         await Database.set_admin(uid, False)
-        await update.message.reply_text(f"User {uid} is no longer admin.")
+        await reply(update, f"User {uid} is no longer admin.")
     except:
-        await update.message.reply_text("Invalid ID.")
+        await reply(update, "Invalid ID.")
 
 async def list_admins(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await is_admin_filter(update, context):
@@ -827,20 +1801,127 @@ async def list_admins(update: Update, context: ContextTypes.DEFAULT_TYPE):
     for a in rows:
         msg += f"• `{a['user_id']}` (@{a.get('username','')})\n"
     msg += f"👑 Owner: `{OWNER_ID}`"
-    await update.message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
+    await reply(update, msg, parse_mode=ParseMode.MARKDOWN)
+
+async def slow_traces(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_admin_filter(update, context):
+        return
+    limit = 5
+    if context.args and context.args[0].isdigit():
+        limit = min(int(context.args[0]), 20)
+    traces = Tracer.slowest(limit)
+    if not traces:
+        await reply(update, "No traces recorded yet.")
+        return
+    header = f"**Slowest of last {len(Tracer._recent)} updates:**\n```\n"
+    footer = "\n```"
+    body = ""
+    shown = 0
+    for t in traces:
+        cmd = t.attrs.get("command", "-")
+        lines = [f"{t.duration_ms:7.0f}ms /{cmd} user={t.attrs.get('user_id', '-')} "
+                 f"{t.source} {t.started_at:%H:%M:%S}"]
+        for name, offset, dur in t.spans:
+            lines.append(f"    {name:<12} +{offset:6.0f}ms {dur:7.0f}ms")
+        block = ("\n" if body else "") + "\n".join(lines)
+        # Whole traces only, so the code fence is always closed; leave room for the omitted note
+        if len(header) + len(body) + len(block) + len(footer) + 40 > TELEGRAM_MAX_TEXT:
+            break
+        body += block
+        shown += 1
+    msg = header + body + footer
+    if shown < len(traces):
+        msg += f"\n({len(traces) - shown} more omitted)"
+    await reply(update, msg, parse_mode=ParseMode.MARKDOWN)
+
+LIVE_WINDOWS = (5, 15, 60)
+
+def live_view(minutes: int) -> (str, InlineKeyboardMarkup):
+    text = "```\n" + Telemetry.render(minutes) + "\n```"
+    buttons = [InlineKeyboardButton(f"{'• ' if m == minutes else ''}{m}m", callback_data=f"live:{m}")
+               for m in LIVE_WINDOWS]
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 Refresh", callback_data=f"live:{minutes}")],
+        buttons,
+    ])
+    return text, keyboard
+
+async def live(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_admin_filter(update, context):
+        return
+    text, keyboard = live_view(15)
+    await reply(update, text, parse_mode=ParseMode.MARKDOWN, reply_markup=keyboard)
+
+async def live_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if not await is_admin_or_owner(query.from_user.id):
+        await query.answer("Admins only.")
+        return
+    minutes = int(query.data.split(":", 1)[1])
+    if minutes not in LIVE_WINDOWS:
+        minutes = 15
+    # Answer right away: the edit may wait behind chat pacing and the query would expire
+    await query.answer()
+    text, keyboard = live_view(minutes)
+    try:
+        await Outbox.submit(query.message.chat.id, query.edit_message_text, text,
+                            {"parse_mode": ParseMode.MARKDOWN, "reply_markup": keyboard})
+    except BadRequest as e:
+        # Refreshing within the same second yields identical text
+        if "not modified" not in str(e).lower():
+            raise
+
+PROFILE_USAGE = ("Usage:\n"
+                 "/profile debug on [slow_ms] | off – asyncio slow-callback logging\n"
+                 "/profile cpu [seconds] – sampling CPU profile (max 30s)\n"
+                 "/profile mem [top_n] | mem stop – tracemalloc top allocations\n"
+                 "/profile tasks – pending tasks with ages")
+
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not await is_admin_filter(update, context):
+        return
+    args = context.args or []
+    kind = args[0].lower() if args else ""
+    if kind == "debug" and len(args) > 1 and args[1].lower() in ("on", "off"):
+        slow_ms = float(args[2]) if len(args) > 2 and args[2].isdigit() else 100
+        await reply(update, Profiler.set_loop_debug(args[1].lower() == "on", slow_ms))
+        return
+    if kind == "cpu":
+        seconds = min(float(args[1]), 30) if len(args) > 1 and args[1].isdigit() else 5
+        await reply(update, f"Sampling CPU for {seconds:.0f}s...")
+        report = await asyncio.to_thread(Profiler.sample_cpu, seconds)
+    elif kind == "mem":
+        if len(args) > 1 and args[1].lower() == "stop":
+            await reply(update, Profiler.stop_memory())
+            return
+        if not tracemalloc.is_tracing():
+            await reply(update, Profiler.memory_report())
+            return
+        limit = min(int(args[1]), 100) if len(args) > 1 and args[1].isdigit() else 25
+        report = Profiler.memory_report(limit)
+    elif kind == "tasks":
+        report = Profiler.tasks_report()
+    else:
+        await reply(update, PROFILE_USAGE)
+        return
+    filename = f"profile_{kind}_{datetime.now():%Y%m%d_%H%M%S}.txt"
+    await reply_document(update, document=report.encode(), filename=filename, caption=f"/profile {kind}")
 
 # Register admin handlers
 admin_handlers = [
     ("broadcast", broadcast), ("dm", dm_user), ("bulkdm", bulk_dm),
     ("ban", ban_user), ("unban", unban_user), ("deleteuser", delete_user),
+    ("bulkban", bulk_ban), ("bulkunban", bulk_unban), ("bulkdelete", bulk_delete),
     ("searchuser", search_user), ("users", list_users), ("recentusers", recent_users),
     ("userlookups", user_lookups), ("leaderboard", leaderboard), ("inactiveusers", inactive_users),
     ("stats", stats), ("dailystats", dailystats), ("lookupstats", lookupstats),
     ("backup", backup), ("fulldbbackup", fulldbbackup), ("addadmin", add_admin),
-    ("removeadmin", remove_admin), ("listadmins", list_admins)
+    ("removeadmin", remove_admin), ("listadmins", list_admins), ("slowtraces", slow_traces),
+    ("live", live), ("lookupresult", lookup_result), ("profile", profile)
 ]
 for cmd, handler in admin_handlers:
     telegram_app.add_handler(CommandHandler(cmd, handler))
+telegram_app.add_handler(CallbackQueryHandler(live_callback, pattern=r"^live:\d+$"))
 
 # ---------- General Message Handler (ignore) ----------
 async def echo(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -848,11 +1929,100 @@ async def echo(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 telegram_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, echo))
 
-# ---------- Webhook Setup ----------
-@app.on_event("startup")
-async def on_startup():
+# ---------- Update Intake (webhook / polling) ----------
+_poller_task: Optional[asyncio.Task] = None
+
+async def dispatch_update(update: Update, source: str):
+    """Run one update through the handlers under a trace; shared by the webhook route and the poller."""
+    with Tracer.trace(source, update_id=update.update_id):
+        await telegram_app.process_update(update)
+
+async def start_services():
+    Profiler.install(asyncio.get_running_loop())
     await Database.init_pool()
     await telegram_app.initialize()
+    Outbox.start()
+    Primer.start()
+
+async def stop_services():
+    # Finish in-flight updates and pending writes before the pool goes away
+    await Primer.stop()
+    await Lifecycle.drain(SHUTDOWN_DRAIN_TIMEOUT)
+    await Outbox.stop()
+    if BOT_MODE == "webhook" and DELETE_WEBHOOK_ON_SHUTDOWN:
+        await telegram_app.bot.delete_webhook()
+    await telegram_app.shutdown()
+    await Database.close_pool()
+
+async def poll_updates():
+    """Long-poll getUpdates and process up to UPDATE_CONCURRENCY updates at a time."""
+    # getUpdates is refused while a webhook is registered
+    logger.warning("Polling mode: removing any registered webhook")
+    await telegram_app.bot.delete_webhook()
+    await telegram_app.updater.start_polling()
+    logger.info(f"Polling for updates (concurrency {UPDATE_CONCURRENCY})")
+    slots = asyncio.Semaphore(UPDATE_CONCURRENCY)
+    queue = telegram_app.update_queue
+    try:
+        while True:
+            # Take a slot first: an update pulled off the queue must never be dropped by cancellation
+            await slots.acquire()
+            try:
+                update = await queue.get()
+            except BaseException:
+                slots.release()
+                raise
+            task = Lifecycle.spawn(dispatch_update(update, "polling"), name="update")
+            task.add_done_callback(lambda _: slots.release())
+    finally:
+        if telegram_app.updater.running:
+            await telegram_app.updater.stop()
+        # Updates already fetched (and acknowledged) must still be handled before draining
+        while not queue.empty():
+            Lifecycle.spawn(dispatch_update(queue.get_nowait(), "polling"), name="update")
+
+def start_poller() -> asyncio.Task:
+    global _poller_task
+    _poller_task = asyncio.create_task(poll_updates(), name="poller")
+    _poller_task.add_done_callback(_on_poller_done)
+    return _poller_task
+
+def _on_poller_done(task: asyncio.Task):
+    if not task.cancelled() and task.exception():
+        logger.error(f"Poller stopped, no more updates will be received: {task.exception()!r}")
+
+def poller_failed() -> bool:
+    return _poller_task is not None and _poller_task.done() and not _poller_task.cancelled()
+
+async def stop_polling():
+    if _poller_task:
+        _poller_task.cancel()
+        await asyncio.gather(_poller_task, return_exceptions=True)
+
+async def run_polling():
+    """Polling mode without FastAPI/uvicorn: serve until SIGINT/SIGTERM."""
+    await start_services()
+    stop = asyncio.Event()
+    # A dead poller ends the process instead of leaving it idle
+    start_poller().add_done_callback(lambda _: stop.set())
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        failed = poller_failed()
+        await stop_polling()
+        await stop_services()
+    if failed:
+        raise SystemExit(1)
+
+@app.on_event("startup")
+async def on_startup():
+    await start_services()
+    if BOT_MODE == "polling":
+        start_poller()
+        return
     # Set webhook
     webhook_url = WEBHOOK_URL.rstrip('/') + "/webhook"
     await telegram_app.bot.set_webhook(url=webhook_url)
@@ -860,22 +2030,38 @@ async def on_startup():
 
 @app.on_event("shutdown")
 async def on_shutdown():
-    await telegram_app.bot.delete_webhook()
-    await telegram_app.shutdown()
-    await Database.close_pool()
+    await stop_polling()
+    await stop_services()
 
 @app.post("/webhook")
 async def webhook(request: Request):
+    if not Lifecycle.is_accepting():
+        # Non-2xx keeps the update queued at Telegram for redelivery to the next instance
+        return Response(status_code=503)
     json_data = await request.json()
     update = Update.de_json(json_data, telegram_app.bot)
-    await telegram_app.process_update(update)
+    # Acknowledge once the update is tracked: shutdown drains it, and a late 2xx would make
+    # Telegram redeliver an update this instance is still processing
+    Lifecycle.spawn(dispatch_update(update, "webhook"), name="update")
     return Response(status_code=200)
 
 @app.get("/")
 async def health():
+    if poller_failed():
+        return Response(status_code=503)
     return {"status": "ok"}
 
 # ---------- Main ----------
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=PORT)
+    if BOT_MODE == "polling":
+        asyncio.run(run_polling())
+    else:
+        import uvicorn
+
+        class Server(uvicorn.Server):
+            def handle_exit(self, sig, frame):
+                # Refuse new updates (503 -> Telegram redelivers) from the moment shutdown starts
+                Lifecycle.stop_accepting()
+                super().handle_exit(sig, frame)
+
+        Server(uvicorn.Config(app, host="0.0.0.0", port=PORT)).run()